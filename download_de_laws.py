@@ -1,18 +1,20 @@
 import os
 import zipfile
 import xml.etree.ElementTree as ET
-import re
-import multiprocessing
+import io
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import requests
+import aiohttp
 
 """
 This function downloads all (>6000) federal laws
 from https://www.gesetze-im-internet.de/gii-toc.xml as
 individual XML and copies them to ./de_federal_raw.
 
-It does so using multiprocessing to speed up the process.
-To use this in a Jupyter notebook you likely need to remove multiprocessing.
+It does so using asyncio and aiohttp to download many laws concurrently.
+To use this in a Jupyter notebook you likely need to await main_async() instead of calling main().
 
 Prerequisites:
 1) Create a virtual environment:
@@ -20,34 +22,67 @@ python3 -m venv ./.venv
 source ./.venv/bin/activate
 
 2) Install dependencies:
-pip3 install tqdm requests
+pip3 install tqdm requests aiohttp
 
 3) Run this script:
 python3 download_de_laws.py
+
+The number of concurrent downloads and unzip threads can be set via the
+MAX_CONCURRENT_DOWNLOADS and MAX_EXTRACT_WORKERS environment variables.
 """
 
+# Constants
+MAX_CONCURRENT_DOWNLOADS = int(os.environ.get('MAX_CONCURRENT_DOWNLOADS', 64))
+MAX_EXTRACT_WORKERS = int(os.environ.get('MAX_EXTRACT_WORKERS', 8))
+MAX_RETRIES = 3
+
 
-def process_law(law):
+def extract_law(data):
     """
-    Function to process each item from the item array. It does the following for each item.
+    Function to extract the XML from the downloaded zip file. The zip file is read from memory and never written to disk.
     """
-    # Download the zip file
-    item_response = requests.get(law['link'], stream=True, timeout=60)
-    zip_name = re.sub(r'\W+', '', law['link']) + '.zip'
-    zip_path = os.path.join('./de_federal_raw/', zip_name)
-    with open(zip_path, 'wb') as file_driver:
-        for chunk in item_response.iter_content(chunk_size=128):
-            file_driver.write(chunk)
-    # Unzip the file
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+    with zipfile.ZipFile(io.BytesIO(data), 'r') as zip_ref:
         for file_name in zip_ref.namelist():
             if file_name.endswith('.xml'):
                 zip_ref.extract(file_name, './de_federal_raw/')
-    # Remove the zip file
-    os.remove(zip_path)
+
+
+async def process_law(session, semaphore, executor, law):
+    """
+    Function to process each item from the item array. It does the following for each item.
+    """
+    # Download the zip file in one read. The session keeps connections alive across laws.
+    # Failed downloads are retried a few times before giving up.
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with semaphore, session.get(law['link'], timeout=aiohttp.ClientTimeout(total=60)) as item_response:
+                item_response.raise_for_status()
+                data = await item_response.read()
+            break
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt == MAX_RETRIES:
+                raise
+    # Unzipping is blocking, so we run it in a thread to keep the event loop free.
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, extract_law, data)
     return 1
 
 
+async def main_async(item_array):
+    """
+    Download all laws in item_array concurrently on a single event loop.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_DOWNLOADS, ttl_dns_cache=300)
+    with ThreadPoolExecutor(max_workers=MAX_EXTRACT_WORKERS) as executor:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = [process_law(session, semaphore, executor, law) for law in item_array]
+            with tqdm(total=len(tasks), desc="Processing files", dynamic_ncols=True) as pbar:
+                for task in asyncio.as_completed(tasks):
+                    await task
+                    pbar.update()
+
+
 def main():
     """
     Download the XML file with all laws and run process_law for each one.
@@ -73,17 +108,11 @@ def main():
     # Set the number of items to process
     num_items_to_process = len(item_array)  # change this to control how many items to process
     print(f"Processing {num_items_to_process} items out of {len(item_array)} total items")
+    print(f"Using up to {MAX_CONCURRENT_DOWNLOADS} concurrent downloads and {MAX_EXTRACT_WORKERS} unzip threads")
 
-    # Initialize a Pool with the number of available processors
-    pool = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-    print(f"Using {multiprocessing.cpu_count()} cores/processes in parallel")
-
-    # Use Pool's map function to process the items in parallel
-    with tqdm(total=num_items_to_process, desc="Processing files", dynamic_ncols=True) as pbar:
-        for _ in pool.imap_unordered(process_law, item_array[:num_items_to_process]):
-            pbar.update()
+    # Download all items concurrently
+    asyncio.run(main_async(item_array[:num_items_to_process]))
 
 
 if __name__ == '__main__':
-    multiprocessing.freeze_support()
     main()
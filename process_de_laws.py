@@ -9,326 +9,451 @@ python3 -m venv ./.venv
 source ./.venv/bin/activate
 
 2) Install dependencies:
-pip3 install bs4 lxml tiktoken tqdm
+pip3 install lxml tiktoken tqdm orjson
 
 3) Run this script:
 python3 process_de_laws.py
 """
 
 import os
-import json
+from pathlib import Path
+import orjson
 from datetime import datetime
-from bs4 import BeautifulSoup
+from lxml import etree
 from typing import Dict, Union, Optional
 import re
+import itertools
 import tiktoken
-import copy
 import multiprocessing
 from tqdm import tqdm
 
 # Constants
 OUTPUT_FILENAME = 'de_federal'  # .json
 XML_DIR_PATH = "./de_federal_raw"  # Folder must exist
-JSON_DIR_PATH = "./de_federal_json"  # Folder must exist
+JSON_DIR_PATH = "./de_federal_json"  # Folder is created if it doesn't exist
 FILE_FILTER = ('')  # ('BJNR002190897', 'BJNR119530979')
-XML_FILENAMES = [f for f in os.listdir(XML_DIR_PATH) if f.endswith(FILE_FILTER+('.xml'))]
+POOL_CHUNKSIZE = 32  # Number of files each worker gets at once
 
-# Initialize output dict
-all_laws = {}
-file_keys = {}  # this dictionary will keep track of the files processed under each key
+# XPath expressions, compiled once. Comments are not text nodes, so their content is ignored.
+TEXT_NODES = etree.XPath('.//text()', smart_strings=False)
+TEXT_NODES_WITHOUT_SUP = etree.XPath('.//text()[not(ancestor::SUP)]', smart_strings=False)
 
+# BeautifulSoup replaced text that only consists of these characters by a single '\n' (if it contains one) or ' '.
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
 
-def convert_xml_to_dict(element, expected_type: Optional[type] = None) -> Union[str, Dict]:
+# Regular expressions, compiled once.
+NORM_PATTERN = re.compile(r'(§+|Art|Artikel)\.?\s*')  # Norms that start with §, Art or Artikel
+NUMBER_PATTERN = re.compile(r"\b\d+[a-zA-Z]?\b")  # A number with optionally one letter, such as 1b
+NON_WORD_PATTERN = re.compile(r'\W+')  # Non-word characters (not a letter, digit)
+DIGITS_PATTERN = re.compile(r'^\d+$')
+WHITESPACE_PATTERN = re.compile(r"\n\s+\n")  # Some paragraphs have a lot of whitespace which we will remove.
+
+# Tokenizer to count the number of tokens of each paragraph, loaded once.
+# https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+ENCODING = tiktoken.get_encoding('cl100k_base')
+TOKENIZER_THREADS = 4
+
+
+def normalize_whitespace(string: Optional[str]) -> Optional[str]:
+    """
+    Function to replace a text that only consists of whitespace by '\n' or ' ', like BeautifulSoup did.
+    """
+    if string and not string.strip(ASCII_SPACES):
+        return '\n' if '\n' in string else ' '
+    return string
+
+
+def get_string(element) -> Optional[str]:
+    """
+    Function to get the text of an element that only contains text (or a single child that only contains text).
+    Returns None otherwise. This is what BeautifulSoup's .string did.
     """
-    Function to recursively convert xml element and its children into dictionary.
+    if len(element) == 0:
+        return normalize_whitespace(element.text)
+    if len(element) == 1 and not element.text and not element[0].tail:
+        return get_string(element[0])
+    return None
+
+
+def get_text(element, separator: str = '', strip: bool = False, text_nodes=TEXT_NODES) -> str:
     """
-    if element.string:
-        return element.string
+    Function to get all text of an element and its children, like BeautifulSoup's get_text().
+    With strip=True, each text node is stripped and empty ones are skipped before joining them with the separator.
+    Otherwise, text nodes that only consist of whitespace are shortened like BeautifulSoup did, see normalize_whitespace().
+    """
+    strings = text_nodes(element)
+    if strip:
+        strings = [string.strip() for string in strings if string.strip()]
     else:
-        children_dict = {}
-        for child in element.contents:
-            if child.name:
-                if child.name in children_dict:
-                    if isinstance(children_dict[child.name], list):
-                        children_dict[child.name].append(convert_xml_to_dict(child))
-                    else:
-                        children_dict[child.name] = [children_dict[child.name], convert_xml_to_dict(child)]
-                else:
-                    children_dict[child.name] = convert_xml_to_dict(child)
-        # The final return should be a dict (when this function is not called by itself)
-        if expected_type is not None and not isinstance(children_dict, expected_type):
-            raise ValueError(f"Expected {expected_type} but got {type(children_dict)}")
-        return children_dict
+        strings = [normalize_whitespace(string) for string in strings]
+    return separator.join(strings)
 
 
-def num_tokens_from_string(string: str) -> int:
+def is_non_number_tag(element) -> bool:
     """
-    Function to count the number of tokens in a string
-    https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+    Function to check if an element is a DL, Revision or table tag (first column). Those sometimes also start with numbers.
     """
-    encoding = tiktoken.get_encoding('cl100k_base')
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
+    return element.tag in ('DL', 'Revision') or (element.tag == 'entry' and element.get('colname') == 'col1')
 
 
-def process_file(filename):
+def iter_number_text(element):
     """
-    For each XML file
+    Function to iterate over the text of an element and its children in document order, skipping non number tags.
+    The text following a skipped tag is still part of the element.
     """
-    # Read file
-    file_path = os.path.join(XML_DIR_PATH, filename)
-    with open(file_path, encoding="utf8") as file:
-        file_content = file.read()
+    if element.text:
+        yield element.text
+    for child in element:
+        if isinstance(child.tag, str) and not is_non_number_tag(child):  # Skip comments and processing instructions
+            yield from iter_number_text(child)
+        if child.tail:
+            yield child.tail
 
-        # Init this to store unprocessed Absätze.
-        unprocessed_absatze = []
 
-        # Parse XML with BeautifulSoup
-        soup = BeautifulSoup(file_content, "lxml-xml")
+def get_first_word(element) -> str:
+    """
+    Function to get the first word of an element's text, ignoring non number tags.
+    This only reads as much text as needed, so we do not need to copy the element and remove those tags first.
+    """
+    word = ''
+    for string in iter_number_text(element):
+        if not word:
+            string = string.lstrip()
+        if not string:
+            continue
+        # A whitespace after the first characters ends the word.
+        if string[0].isspace():
+            break
+        first_part = string.split(None, 1)[0]
+        word += first_part
+        if len(first_part) < len(string):
+            break
+    return word
+
+
+def iter_norms(file_path: str):
+    """
+    Function to iterate over all norms of an XML file while it is parsed.
+    Each norm is cleared after it was processed, so that only one norm at a time is kept in memory.
+    We parse leniently (recover=True) like BeautifulSoup's lxml-xml parser did, so that malformed XML files still get processed.
+    """
+    for _, norm in etree.iterparse(file_path, events=('end',), tag='norm', recover=True):
+        yield norm
+        norm.clear(keep_tail=True)
+        # Also remove the processed norms from the root element.
+        while norm.getprevious() is not None:
+            del norm.getparent()[0]
 
-        """
-        Law Metadata
-        """
-        output = {
-            'meta': {
-                'source': filename,
-                'download_date': datetime.fromtimestamp(os.path.getctime(file_path)).strftime("%Y-%m-%d"),
-                'title': '',
-                'last_changed': '',
-                'alt_title': '',
-            },
-            'metadaten': convert_xml_to_dict(soup.metadaten, dict),
-            'norms': []
-        }
-        output['meta']['last_changed'] = output['metadaten'].get('ausfertigung-datum')
-        try:
-            output['meta']['title'] = soup.metadaten.langue.text
-        except AttributeError:
-            pass
 
-        """
-        Get the unique key (such as 'BGB') of each law/gesetz. We are jusing jurabk, but if it is not available, we use amtabk.
-        It is not fully clear what these abbreviations mean, but likely:
-        jurabk = Judicial abbreviation of the law.
-        amtabk = Official (Amtliche) abbreviation of the law.
-        We prefere jurabk over amtabk because it seems to be more common.
-        """
-        key_planned = output['metadaten'].get('jurabk', output['metadaten'].get('amtabk'))
-        # In rare cases, a law has multiple of these keys. In that case, we will use the first one.
-        while isinstance(key_planned, list):
-            key_planned = key_planned[0]
+def convert_xml_to_dict(element) -> Union[str, Dict]:
+    """
+    Function to convert xml element and its children into dictionary.
+    Elements that only contain text become strings. Children with the same tag are collected in a list.
+    Instead of recursion, we use a stack of the elements whose children still need to be converted.
+    """
+    string = get_string(element)
+    if string:
+        return string
+    # First, we put all children in lists. Afterwards, we replace lists with a single child by the child itself.
+    children_dict = {}
+    all_dicts = [children_dict]
+    stack = [(element, children_dict)]
+    while stack:
+        parent, parent_dict = stack.pop()
+        for child in parent:
+            if isinstance(child.tag, str):  # Skip comments and processing instructions
+                string = get_string(child)
+                if string:
+                    parent_dict.setdefault(child.tag, []).append(string)
+                else:
+                    child_dict = {}
+                    parent_dict.setdefault(child.tag, []).append(child_dict)
+                    all_dicts.append(child_dict)
+                    stack.append((child, child_dict))
+    for this_dict in all_dicts:
+        for tag, children in this_dict.items():
+            if len(children) == 1:
+                this_dict[tag] = children[0]
+    return children_dict
+
+
+def process_file(xml_file):
+    """
+    For each XML file, given as (filename, ctime)
+    """
+    filename, ctime = xml_file
+    file_path = os.path.join(XML_DIR_PATH, filename)
 
-        def remove_year_from_key(key_planned):
-            if isinstance(key_planned[-4:], str) and key_planned[-4:].isdigit():
-                key_planned = key_planned[:-4].strip()
-            return key_planned
+    # Init this to store unprocessed Absätze.
+    unprocessed_absatze = []
+    # Texts of all Absätze and the paragraphs they belong to, so that we can count all tokens in one batch at the end.
+    token_texts = []
+    token_paragraphs = []
+    # (norm_id, paragraph_id) of all paragraphs in output['norms'], to find duplicates without going through all norms again.
+    seen_paragraphs = set()
+
+    # Read and parse the XML file with lxml, norm by norm. It reads the raw bytes itself and detects the encoding from the XML declaration.
+    norms = iter_norms(file_path)
+    first_norm = next(norms, None)
+    if first_norm is None:
+        print(f"Could not find any norm in {filename}")
+        return None
 
-        """
-        We have some edge cases, where neither jurabk nor amtabk is a good name for the law. For example, UStG is called UStG 1980.
-        So, if the key ends with a year, remove the year unless that would cause duplicates. There are laws where the year at the end makes sense.
-        """
-        # If the key ends with 4 digits, it ends with a year.
-        key_process = remove_year_from_key(key_planned)
-        # If the key is not unique
-        if key_process in file_keys or key_planned in file_keys:
-            previous_output_key = key_process
-            # If a duplicate is found, rename the previous law to a law with the year suffix.
-            # Get the key we want to use for the previous law instead (with the year)
-            corrected_previous_output_key = all_laws[previous_output_key]['metadaten'].get(
-                'jurabk', all_laws[previous_output_key]['metadaten'].get('amtabk')
-              )
-            # Rename the previous law's key by writing it again and deleting the old entry.
-            if (corrected_previous_output_key != previous_output_key):
-                all_laws[corrected_previous_output_key] = all_laws[previous_output_key]
-                del all_laws[previous_output_key]
-                # Do the same for file_keys
-                file_keys[corrected_previous_output_key] = file_keys[previous_output_key]
-                del file_keys[previous_output_key]
-            # Since stripping the year causes duplicates, we will use the key with the year for this law too.
-            key_process = key_planned
-        file_keys[key_process] = filename
-
-        alt_jurabk = output['metadaten'].get('jurabk')
-        if (alt_jurabk):
-            alt_jurabk = remove_year_from_key(alt_jurabk)
-        alt_amtabk = output['metadaten'].get('amtabk')
-        if (alt_amtabk):
-            alt_amtabk = remove_year_from_key(alt_amtabk)
-
-        # If both myjurabk and myamtabk are not None and not identical, print
-        if alt_jurabk and alt_amtabk and alt_jurabk != alt_amtabk:
-            # Save the one that is not key_planned to alt_title
-            if alt_jurabk != key_planned:
-                output['meta']['alt_title'] = str(alt_jurabk)
-            else:
-                output['meta']['alt_title'] = str(alt_amtabk)
+    """
+    Law Metadata
+    The metadata of the law is in the first norm.
+    """
+    metadaten = first_norm.find('metadaten')
+    output = {
+        'meta': {
+            'source': filename,
+            'download_date': '',
+            'title': '',
+            'last_changed': '',
+            'alt_title': '',
+        },
+        'metadaten': convert_xml_to_dict(metadaten),
+        'norms': []
+    }
+    output['meta']['last_changed'] = output['metadaten'].get('ausfertigung-datum')
+    langue = metadaten.find('langue')
+    if langue is not None:
+        output['meta']['title'] = get_text(langue)
+
+    """
+    Get the unique key (such as 'BGB') of each law/gesetz. We are jusing jurabk, but if it is not available, we use amtabk.
+    It is not fully clear what these abbreviations mean, but likely:
+    jurabk = Judicial abbreviation of the law.
+    amtabk = Official (Amtliche) abbreviation of the law.
+    We prefere jurabk over amtabk because it seems to be more common.
+    """
+    key_planned = output['metadaten'].get('jurabk', output['metadaten'].get('amtabk'))
+    # In rare cases, a law has multiple of these keys. In that case, we will use the first one.
+    while isinstance(key_planned, list):
+        key_planned = key_planned[0]
+
+    def remove_year_from_key(key_planned):
+        if isinstance(key_planned[-4:], str) and key_planned[-4:].isdigit():
+            key_planned = key_planned[:-4].strip()
+        return key_planned
+
+    # If the key ends with 4 digits, it ends with a year. Whether we can use the key without the year
+    # depends on the other laws, so the final key is decided in assign_keys() after all files are processed.
+    key_process = remove_year_from_key(key_planned) if isinstance(key_planned, str) else None
+
+    # Without a key we cannot add the law to the output, so we do not need to process its norms.
+    if key_process is None or len(key_process) == 0:
+        print(f"Could not find amtabk or jurabk for {filename}")
+        return None
+    output['meta']['download_date'] = datetime.fromtimestamp(ctime).strftime("%Y-%m-%d")
+
+    alt_jurabk = output['metadaten'].get('jurabk')
+    if (alt_jurabk):
+        alt_jurabk = remove_year_from_key(alt_jurabk)
+    alt_amtabk = output['metadaten'].get('amtabk')
+    if (alt_amtabk):
+        alt_amtabk = remove_year_from_key(alt_amtabk)
+
+    # If both myjurabk and myamtabk are not None and not identical, print
+    if alt_jurabk and alt_amtabk and alt_jurabk != alt_amtabk:
+        # Save the one that is not key_planned to alt_title
+        if alt_jurabk != key_planned:
+            output['meta']['alt_title'] = str(alt_jurabk)
+        else:
+            output['meta']['alt_title'] = str(alt_amtabk)
+
+    """
+    Get the norms of the law
+    """
+    for law in itertools.chain([first_norm], norms):
+        this_norm = {
+            'meta': {},
+            'paragraphs': []
+        }
 
         """
-        Get the norms of the law
+        Norm Metadata
         """
-        for law in soup.find_all('norm'):
-            this_norm = {
-                'meta': {},
-                'paragraphs': []
+        law_metadaten = law.find('metadaten')
+        this_metadaten = convert_xml_to_dict(law_metadaten)
+
+        # For now, Only process norms that start with §, Art, Artikel (everything else is e.g. Inhaltsverzeichnis, Anlage) (TODO)
+        if isinstance(this_metadaten, dict) and this_metadaten.get('enbez') and NORM_PATTERN.match(this_metadaten['enbez']):
+            this_norm['meta'] = {
+                'norm_id': this_metadaten['enbez'],
+                'title': ''
             }
+            titel = law_metadaten.find('titel')
+            if titel is not None:
+                this_norm['meta']['title'] = get_text(titel)
+
+            # Some laws have a "Gliederung", e.g. Art I, Art II. This would lead to duplicate titles if we ignore it
+            # With this, it will look like this: Art I §1, Art II §1
+            if this_metadaten.get('gliederungseinheit') and this_metadaten.get('gliederungseinheit').get('gliederungsbez'):
+                this_norm['meta']['norm_id'] = this_metadaten['gliederungseinheit']['gliederungsbez'] + ' ' + this_norm['meta']['norm_id']
 
             """
-            Norm Metadata
+            Norm Content
             """
-            this_metadaten = convert_xml_to_dict(law.find('metadaten'), dict)
-
-            # For now, Only process norms that start with §, Art, Artikel (everything else is e.g. Inhaltsverzeichnis, Anlage) (TODO)
-            pattern_norm = r'(§+|Art|Artikel)\.?\s*'
-            if isinstance(this_metadaten, dict) and this_metadaten.get('enbez') and re.match(pattern_norm, this_metadaten['enbez']):
-                this_norm['meta'] = {
-                    'norm_id': this_metadaten['enbez'],
-                    'title': ''
-                }
-                try:
-                    this_norm['meta']['title'] = law.find('metadaten').titel.text
-                except AttributeError:
-                    pass
-
-                # Some laws have a "Gliederung", e.g. Art I, Art II. This would lead to duplicate titles if we ignore it
-                # With this, it will look like this: Art I §1, Art II §1
-                if this_metadaten.get('gliederungseinheit') and this_metadaten.get('gliederungseinheit').get('gliederungsbez'):
-                    this_norm['meta']['norm_id'] = this_metadaten['gliederungseinheit']['gliederungsbez'] + ' ' + this_norm['meta']['norm_id']
+            this_content = law.find('textdaten/text/Content')
+            if this_content is not None:
 
                 """
-                Norm Content
-                """
-                if (law.find('textdaten') and law.find('textdaten').find('text') and law.find('textdaten').find('text').find('Content')):
+                Norm Content - P Tag (Absätze)
+                Wa want to put all Absätze in an array of paragraphs with their paragraph number.
 
-                    """
-                    Norm Content - P Tag (Absätze)
-                    Wa want to put all Absätze in an array of paragraphs with their paragraph number.
+                Some paragraphs are numbered at the beginning of each paragraph, e.g. "(1) Die...".
+                Of those, sometimes a new P tag starts without a new number meaning it belongs to the previous paragraph.
+                For this logic, we need p_is_numbered so that we now that the paragraphs in the norm are numbered.
 
-                    Some paragraphs are numbered at the beginning of each paragraph, e.g. "(1) Die...".
-                    Of those, sometimes a new P tag starts without a new number meaning it belongs to the previous paragraph.
-                    For this logic, we need p_is_numbered so that we now that the paragraphs in the norm are numbered.
+                If a paragraph is not numbered, we will count ourselves with p_i.
+                """
+                paragraph_ids = set()  # The paragraph_ids of this norm
+                continuation_target = None  # The paragraph a P without a number continues, None if it was skipped as a duplicate
+                p_i = 0
+                p_is_numbered = False
+                for P in this_content.findall('P'):
+                    # findall('P') only gets direct children (and e.g. not nested Ps such as in 'Revision' tags)
+                    # Examples for laws with Revision tags: e.g. kstg § 34. Lambda e.g. bmelddav §5
+                    p_i += 1
+                    number = p_i
+                    number_missing = False
+
+                    # We want to check if the P tag has numbering in the beginning [(1) or 1]
+                    # so that we can use it as it is more reliable then counting ourselves.
+                    # However, we need to ignore DL, Revision and table tags which sometimes also start with nubmers.
+                    first_part = get_first_word(P)  # The text until the first whitespace, leaving us with the first word.
+                    # Now, we can identify the right number for the paragraph
+                    if first_part:
+                        # If the regex matches, we have a number (with optionally one letter, such as 1b)
+                        match = NUMBER_PATTERN.search(first_part)
+                        if match:  # If a match was found
+                            number = match.group()  # Get the matched string
+                            number = NON_WORD_PATTERN.sub('', number)  # Remove non-word characters (not a letter, digit)
+                            p_is_numbered = True  # We now know that this norm has numbered paragraphs.
+
+                            # Some laws have errors, e.g. BJNR048500995 § 6 has two (2).
+                            # Therefore we need to check if we would add a duplicate.
+                            # For now we're not correcting the wrong (2) at the beginning
+                            if number in paragraph_ids:
+                                if bool(DIGITS_PATTERN.match(number)):
+                                    number = int(number)
+                                    number += 1
+                                else:
+                                    number = str(number) + "_"
+
+                        # If we have not found a match, but previously did, this P tag continues the previous paragraph.
+                        elif p_is_numbered:
+                            number_missing = True
+                        # If no match was found, the P has unumbered paragraphs and we will count ourselves.
+                        else:
+                            number = p_i
+
+                    # Ignore all SUP tags for now. Those are the little numbers in the text that refer to the sentence number (TODO).
+                    # The content is created by this configuration of get_text(): it strips all text of leading and ending whitespace
+                    # and then puts all text togther separated by a whitespace.
+                    # The token count is filled in after all norms are processed.
+
+                    # However, if the number in a numbered paragraph was missing, we will add the content to the previous paragraph.
+                    # If the previous paragraph was skipped as a duplicate, its continuation is skipped, too.
+                    if number_missing:
+                        if continuation_target is not None:
+                            token_texts.append(get_text(P, text_nodes=TEXT_NODES_WITHOUT_SUP))
+                            token_paragraphs.append(continuation_target)
+                            continuation_target['content'] += " " + WHITESPACE_PATTERN.sub("\n\n", get_text(P, " ", strip=True, text_nodes=TEXT_NODES_WITHOUT_SUP))
+                        continue
 
-                    If a paragraph is not numbered, we will count ourselves with p_i.
                     """
-                    this_content = law.find('textdaten').find('text').find('Content')
-                    whitespace_pattern = r"\n\s+\n"  # Some paragraphs have a lot of whitespace which we will remove.
-                    p_i = 0
-                    p_is_numbered = False
-                    for P in this_content.find_all('P', recursive=False):
-                        # recursive=False so that we only get direct children (and e.g. not nested Ps such as in 'Revision' tags)
-                        # Examples for laws with Revision tags: e.g. kstg § 34. Lambda e.g. bmelddav §5
-                        p_i += 1
-                        number = p_i
-                        number_missing = False
-
-                        # We want to check if the P tag has numbering in the beginning [(1) or 1]
-                        # so that we can use it as it is more reliable then counting ourselves.
-                        # However, we need to remove DL, Revision and table tags which sometimes also start with nubmers.
-                        P_copy = copy.deepcopy(P)
-                        for tag in P_copy.find_all(['DL', 'Revision', lambda t: t.name == 'entry' and t.get('colname') == 'col1']):
-                            tag.decompose()
-                        P_split = P_copy.text.split()  # We split the text at the first whitespace, leaving us with the first word.
-                        # Now, we can identify the right number for the paragraph
-                        if P_split:
-                            first_part = P_split[0]
-                            pattern_number = r"\b\d+[a-zA-Z]?\b"
-                            # If the regex matches, we have a number (with optionally one letter, such as 1b)
-                            match = re.search(pattern_number, first_part)
-                            if match:  # If a match was found
-                                number = match.group()  # Get the matched string
-                                number = re.sub(r'\W+', '', number)  # Remove non-word characters (not a letter, digit)
-                                p_is_numbered = True  # We now know that this norm has numbered paragraphs.
-
-                                # Some laws have errors, e.g. BJNR048500995 § 6 has two (2).
-                                # Therefore we need to check if we would add a duplicate. (TODO - optimize part)
-                                for paragraph in this_norm['paragraphs']:
-                                    number = str(number)
-                                    if str(paragraph['meta']['paragraph_id']) == number:
-                                        if bool(re.match('^\d+$', number)):
-                                            number = int(number)
-                                            number += 1
-                                        else:
-                                            number = str(number) + "_"
-                                        break  # For now we're not correcting the wrong (2) at the beginning
-
-                            # If we have not found a match, but previously did, this P tag continues the previous paragraph.
-                            elif p_is_numbered:
-                                number_missing = True
-                                number = p_i-1
-                            # If no match was found, the P has unumbered paragraphs and we will count ourselves.
-                            else:
-                                number = p_i
-
-                        # Remove all SUP tags for now. Those are the little numbers in the text that refer to the sentence number (TODO).
-                        for sup in P('SUP'):
-                            sup.extract()
-
-                        # This is our paragraph object that we will push to the paragraphs array.
-                        # This configuration of get_text() strips all text of leading and ending whitespace
-                        # and then puts all text togther separated by a whitespace.
+                    Otherwise, we have a new paragraph.
+                    We will now do a final check if the paragraph we want to push might be a duplicate.
+                    We will check all paragraphs of previous norms with the same norm_id.
+                    For example, indmeterprobv has § 3 twice, which leads to a duplicate.
+                    Original: https://www.gesetze-im-internet.de/indmeterprobv/__3.html
+                    Duplicate: https://www.gesetze-im-internet.de/indmeterprobv/__3_1.html
+                    """
+                    if (this_norm['meta']['norm_id'], str(number)) in seen_paragraphs:
+                        # We found a duplicate
+                        unprocessed_absatze.append(f"{filename} {key_process} {this_norm['meta']['norm_id']} {number}")
+                        continuation_target = None
+                    # Only if we don't have a duplicate, we will push this paragraph object to the paragraphs array.
+                    else:
                         p_obj = {
                             'meta': {
                                 'paragraph_id': str(number),
-                                'token': num_tokens_from_string(P.text)
+                                'token': 0
                             },
-                            'content': re.sub(whitespace_pattern, "\n\n", P.get_text(" ", strip=True))
+                            'content': WHITESPACE_PATTERN.sub("\n\n", get_text(P, " ", strip=True, text_nodes=TEXT_NODES_WITHOUT_SUP))
                         }
+                        token_texts.append(get_text(P, text_nodes=TEXT_NODES_WITHOUT_SUP))
+                        token_paragraphs.append(p_obj)
+                        this_norm['paragraphs'].append(p_obj)
+                        continuation_target = p_obj
+                        paragraph_ids.add(p_obj['meta']['paragraph_id'])
 
-                        # However, if the number in a numbered paragraph was missing, we will add the content to the previous paragraph.
-                        if number_missing:
-                            for paragraph in this_norm['paragraphs']:
-                                if str(paragraph['meta']['paragraph_id']) == str(number):
-                                    paragraph['meta']['token'] += p_obj['meta']['token']
-                                    paragraph['content'] += " " + p_obj['content']
-                                    break
+            # Pushing the fully processed norm to the output dict.
+            output['norms'].append(this_norm)
+            for paragraph in this_norm['paragraphs']:
+                seen_paragraphs.add((this_norm['meta']['norm_id'], paragraph['meta']['paragraph_id']))
 
-                        # Otherwise, we have a new paragraph.
-                        else:
-                            """
-                            We will now do a final check if the paragraph we want to push might be a duplicate.
-                            We will go through all paragraphs of the current norm and check.
-                            For example, indmeterprobv has § 3 twice, which leads to a duplicate.
-                            Original: https://www.gesetze-im-internet.de/indmeterprobv/__3.html
-                            Duplicate: https://www.gesetze-im-internet.de/indmeterprobv/__3_1.html
-                            """
-                            hard_duplicate = False
-                            for norm in output['norms']:
-                                if norm['meta']['norm_id'] == this_norm['meta']['norm_id']:
-                                    for paragraph in norm['paragraphs']:
-                                        if paragraph['meta']['paragraph_id'] == p_obj['meta']['paragraph_id']:
-                                            # We found a duplicate
-                                            hard_duplicate = True
-                                            unprocessed_absatze.append(f"{filename} {key_process} {this_norm['meta']['norm_id']} {number}")
-                                            break
-                            # Only if we don't have a duplicate, we will push this paragraph.
-                            if not hard_duplicate:
-                                this_norm['paragraphs'].append(p_obj)
-
-                # Pushing the fully processed norm to the output dict.
-                output['norms'].append(this_norm)
+    # Count the tokens of all Absätze in one batch, which is much faster than encoding them one by one.
+    for paragraph, tokens in zip(token_paragraphs, ENCODING.encode_batch(token_texts, num_threads=TOKENIZER_THREADS)):
+        paragraph['meta']['token'] += len(tokens)
 
-        """
-        Law Finish
-        """
-        # Add the law to the output dict
-        if key_process is not None and isinstance(key_process, str) and len(key_process) > 0:
-            all_laws[key_process] = output
-            output = {
-                'key': key_process,
-                'output': output,
-                'unprocessed_absatze': unprocessed_absatze
-            }
-            filename_without_ending = filename.split('.')[0]
-            file_path_json = os.path.join(JSON_DIR_PATH, filename_without_ending)
-            with open(f'{file_path_json}.json', 'w') as f:
-                json.dump(output, f, ensure_ascii=False)
-        else:
-            print(f"Could not find amtabk or jurabk for {filename}")
+    """
+    Law Finish
+    """
+    # Write the law to its own JSON file and return what assign_keys() needs to know about it.
+    output = {
+        'key': key_process,
+        'key_planned': key_planned,
+        'output': output,
+        'unprocessed_absatze': unprocessed_absatze
+    }
+    filename_without_ending = filename.split('.')[0]
+    file_path_json = os.path.join(JSON_DIR_PATH, filename_without_ending)
+    Path(f'{file_path_json}.json').write_bytes(orjson.dumps(output))
+    return f'{filename_without_ending}.json', key_process, key_planned
+
+
+def assign_keys(processed_files) -> Dict[str, str]:
+    """
+    Function to get the final key of each law, given the (json_filename, key_process, key_planned) of all processed files.
+    This runs in the main process because it needs to know the keys of all laws.
+
+    We have some edge cases, where neither jurabk nor amtabk is a good name for the law. For example, UStG is called UStG 1980.
+    So, if the key ends with a year, remove the year unless that would cause duplicates. There are laws where the year at the end makes sense.
+    If two laws have the same key, the one that comes later (by filename) replaces the earlier one.
+    """
+    file_keys = {}  # this dictionary will keep track of the (json_filename, key_planned) processed under each key
+    for json_filename, key_process, key_planned in sorted(processed_files):
+        # If the key is not unique
+        if key_process in file_keys or key_planned in file_keys:
+            previous_output_key = key_process
+            # If a duplicate is found, rename the previous law to a law with the year suffix.
+            if previous_output_key in file_keys:
+                # Get the key we want to use for the previous law instead (with the year)
+                corrected_previous_output_key = file_keys[previous_output_key][1]
+                # Rename the previous law's key by writing it again and deleting the old entry.
+                if (corrected_previous_output_key != previous_output_key):
+                    file_keys[corrected_previous_output_key] = file_keys.pop(previous_output_key)
+            # Since stripping the year causes duplicates, we will use the key with the year for this law too.
+            key_process = key_planned
+        file_keys[key_process] = (json_filename, key_planned)
+    return {json_filename: key for key, (json_filename, _) in file_keys.items()}
 
 
 def main():
     """
     Process the XML files using multiprocessing
     """
+    # Create directory if it doesn't exist
+    os.makedirs(JSON_DIR_PATH, exist_ok=True)
+
+    # Get the (filename, ctime) of all XML files. os.scandir lets us get the ctime here once instead of in each worker.
+    # This happens in main() and not at import, because with the spawn start method every worker imports this module again.
+    with os.scandir(XML_DIR_PATH) as entries:
+        XML_FILES = [(entry.name, entry.stat().st_ctime) for entry in entries if entry.name.endswith(FILE_FILTER+('.xml'))]
+    XML_FILENAMES = [filename for filename, _ in XML_FILES]
 
     # Initialize a Pool with the number of available processors
     pool = multiprocessing.Pool(processes=multiprocessing.cpu_count())
@@ -336,9 +461,12 @@ def main():
 
     # Processing the files with the process_file() function in parallel.
     # We are also updating a timer with tqdm.
+    processed_files = []
     try:
         with tqdm(total=len(XML_FILENAMES), desc="Processing files", dynamic_ncols=True) as pbar:
-            for _ in pool.imap_unordered(process_file, XML_FILENAMES):
+            for processed_file in pool.imap_unordered(process_file, XML_FILES, chunksize=POOL_CHUNKSIZE):
+                if processed_file is not None:
+                    processed_files.append(processed_file)
                 pbar.update()
     finally:
         pool.close()
@@ -349,22 +477,28 @@ def main():
     """
     print(f"Writing to {OUTPUT_FILENAME}.json ...")
 
-    # Get all the JSON filenames in an array
-    JSON_FILENAMES = [f for f in os.listdir(JSON_DIR_PATH) if f.endswith(FILE_FILTER+('.json'))]
+    # Get the final key of each JSON file we have written
+    json_keys = assign_keys(processed_files)
 
-    # Merge all JSON files to one all_json object and write that to JSON.
+    # Merge all JSON files to one JSON object. We write each law directly to the output file
+    # so that only one law at a time has to be kept in memory.
     # We will also store the unprocessed Absätze to write these to a file, too.
-    all_json = {}
+    all_json_sources = set()
     all_unprocessed_absatze = []
-    for filename in JSON_FILENAMES:
-        file_path_json = os.path.join(JSON_DIR_PATH, filename)
-        with open(file_path_json, encoding="utf8") as file:
-            data = json.load(file)
-            all_json[data['key']] = data['output']
+    with open(f'{OUTPUT_FILENAME}.json', 'wb') as f:
+        f.write(b'{')
+        for filename, key in sorted(json_keys.items()):
+            file_path_json = os.path.join(JSON_DIR_PATH, filename)
+            with open(file_path_json, 'rb') as file:
+                data = orjson.loads(file.read())
             if data['unprocessed_absatze']:
                 all_unprocessed_absatze.append(data['unprocessed_absatze'])
-    with open(f'{OUTPUT_FILENAME}.json', 'w') as f:
-        json.dump(all_json, f, ensure_ascii=False)
+            if all_json_sources:
+                f.write(b',')
+            f.write(orjson.dumps(key) + b':')
+            f.write(orjson.dumps(data['output']))
+            all_json_sources.add(data['output']['meta']['source'])
+        f.write(b'}')
 
     """
     Create Analysis of results
@@ -375,16 +509,11 @@ def main():
         for item in all_unprocessed_absatze:
             f.write("%s\n" % item)
 
-    # Get all all_json_sources we have processed
-    all_json_sources = set()
-    for key in all_json:
-        all_json_sources.add(all_json[key]['meta']['source'])
-
-    # Store all all_json_sources that are not in XML_FILENAMES to a file
+    # Store all XML_FILENAMES that are not in all_json_sources to a file
+    missing_files = sorted(set(XML_FILENAMES) - all_json_sources)
     with open(f'{OUTPUT_FILENAME}_missing_files.txt', 'w') as f:
-        for item in XML_FILENAMES:
-            if item not in all_json_sources:
-                f.write("%s\n" % item)
+        for item in missing_files:
+            f.write("%s\n" % item)
 
     """
     Present results
@@ -392,7 +521,7 @@ def main():
 
     print("--- STATS ---")
     print(f"- Written to JSON {len(all_json_sources)} / {len(XML_FILENAMES)} files")
-    print(f"- {len(XML_FILENAMES) - len(all_json_sources)} missing files are written to {OUTPUT_FILENAME}_missing_files.txt'")
+    print(f"- {len(missing_files)} missing files are written to {OUTPUT_FILENAME}_missing_files.txt'")
     print(f"- {len(all_unprocessed_absatze)} unprocessed Absätze are written to {OUTPUT_FILENAME}_unprocessed_absatze.txt'")
     print("--- DONE ---")
 